@@ -2,9 +2,13 @@
 
 import os
 import streamlit as st
+import altair as alt
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 import plotly.express as px
+from numba import njit
 
 st.set_page_config(page_title="Delivery Dashboard – FA2", layout="wide")
 st.title("📦 Last-mile Delivery Dashboard")
@@ -16,19 +20,7 @@ if not os.path.exists(DATA_PATH):
     st.stop()
 
 
-df_raw = pd.read_csv(DATA_PATH, dtype=str) 
-st.sidebar.markdown("*Data preview & diagnostics*")
-
-
-df_raw.columns = [c.strip() for c in df_raw.columns]
-df = df_raw.copy()
-for c in df.columns:
-    try:
-        df[c] = df[c].astype(str).str.strip().replace({"": np.nan, "nan": np.nan, "None": np.nan})
-    except Exception:
-        pass
-
-variants = {
+VARIANTS = {
     "Delivery_Time": ["Delivery_Time", "Delivery Time", "delivery_time", "delivery time", "TimeTaken", "Time Taken"],
     "Weather": ["Weather", "weather", "WEATHER"],
     "Traffic": ["Traffic", "traffic", "Traffic Level", "Traffic_Level"],
@@ -38,27 +30,94 @@ variants = {
     "Area": ["Area", "area", "Delivery Area", "Location"],
     "Category": ["Category", "category", "Product Category"]
 }
-
-col_map = {}
-available_cols = set(df.columns.tolist())
-
-for target, variant_list in variants.items():
-    found = None
-    for v in variant_list:
-        if v in available_cols:
-            found = v
-            break
-  
-        for ac in available_cols:
-            if ac.lower() == v.lower():
-                found = ac
-                break
-        if found:
-            break
-    if found:
-        col_map[target] = found
-    else:
-        col_map[target] = None
+FILTER_COLS = ["Weather", "Traffic", "Vehicle", "Area", "Category"]
+GROUP_COLS = ["Weather", "Traffic", "Vehicle", "Area"]
+SCATTER_MAX_POINTS = 5000
+
+
+@st.cache_data(show_spinner=False)
+def load_and_clean(path, mtime):
+    # mtime is only part of the cache key, so an edited CSV gets re-read.
+    header = pd.read_csv(path, nrows=0).columns
+    raw_names = {c.strip(): c for c in header}
+
+    available_cols = set(raw_names)
+    lower_cols = {c.lower(): c for c in raw_names}
+
+    # An exact header match wins; otherwise fall back to a case-insensitive one.
+    col_map = {}
+    for target, variant_list in VARIANTS.items():
+        col_map[target] = next(
+            (v if v in available_cols else lower_cols[v.lower()] for v in variant_list if v.lower() in lower_cols),
+            None,
+        )
+
+    diag = {"columns": list(raw_names), "col_map": col_map}
+    if col_map["Delivery_Time"] is None:
+        return None, np.nan, np.nan, {}, diag
+
+    numeric_cols = ["Delivery_Time", "Agent_Rating", "Agent_Age"]
+    mapped = {t: raw_names[src] for t, src in col_map.items() if src}
+    usecols = list(dict.fromkeys(mapped.values()))
+    dtypes = {raw: ("float64" if t in numeric_cols else "string[pyarrow]") for t, raw in mapped.items()}
+    try:
+        df = pd.read_csv(path, engine="pyarrow", usecols=usecols, dtype=dtypes)
+    except Exception:
+        # A numeric column holds text: let it infer and coerce below; only text columns are forced to str.
+        df = pd.read_csv(path, usecols=usecols, dtype={raw: str for raw, d in dtypes.items() if d != "float64"})
+
+    null_tokens = pa.array(["", "nan", "None"])
+    work = pd.DataFrame(index=df.index)
+    for target in VARIANTS.keys():
+        src = mapped.get(target)
+        if not src:
+            work[target] = np.nan
+        elif target in numeric_cols:
+            work[target] = pd.to_numeric(df[src], errors="coerce")
+        else:
+            # Trim and null out blanks in Arrow's C kernels rather than per-row .str calls.
+            text = pc.utf8_trim_whitespace(pa.array(df[src]))
+            text = pc.if_else(pc.is_in(text, value_set=null_tokens), pa.scalar(None, pa.string()), text)
+            work[target] = pd.Series(pd.array(text, dtype="string[pyarrow]"), index=df.index)
+
+    diag["before_rows"] = len(work)
+    work = work.dropna(subset=["Delivery_Time"])
+    diag["after_rows"] = len(work)
+
+    # Bin the ages before the Int16 cast below, so out-of-range values still land in "Unknown".
+    # Right-closed edges reproduce the old pd.cut bins, fractional ages included; missing
+    # ages count as "<25" as before, while negative and >200 ages go to "Unknown".
+    # The "Unknown" level is always present, even when no row uses it.
+    age_bins = np.digitize(work["Agent_Age"].fillna(0).to_numpy(), [-1, 24, 40, 200], right=True)
+    age_codes = np.array([3, 0, 1, 2, 3])[age_bins]
+    work["Age_Group"] = pd.Categorical.from_codes(age_codes, categories=["<25", "25-40", "40+", "Unknown"])
+
+    # Minutes, ratings and ages fit in half the width; every scan below streams fewer bytes.
+    # Implausible ages become NA first, so one bad row cannot break the Int16 cast.
+    work = work.astype({"Delivery_Time": "float32", "Agent_Rating": "float32"})
+    age = work["Agent_Age"]
+    work["Agent_Age"] = age.where(age.between(0, 200)).round().astype("Int16")
+
+    # Integer-coded categories make isin/groupby compare codes instead of strings.
+    for c in FILTER_COLS:
+        work[c] = work[c].astype("category")
+
+    mean_dt = work["Delivery_Time"].mean()
+    std_dt = work["Delivery_Time"].std()
+    work["Late"] = work["Delivery_Time"] > (mean_dt + std_dt)
+    uniques = {c: work[c].cat.categories.tolist() for c in FILTER_COLS}
+    return work, mean_dt, std_dt, uniques, diag
+
+
+data_version = os.path.getmtime(DATA_PATH)
+# cache_data hands back a fresh unpickled copy on every call; the frame is never
+# mutated, so keep this session's copy and only go back to the cache when the CSV changes.
+if st.session_state.get("data_version") != data_version:
+    st.session_state.data = load_and_clean(DATA_PATH, data_version)
+    st.session_state.data_version = data_version
+work, mean_dt, std_dt, UNIQUES, diag = st.session_state.data
+col_map = diag["col_map"]
+st.sidebar.markdown("*Data preview & diagnostics*")
 
 
 st.sidebar.write("*Column mapping (target → file column)*")
@@ -66,46 +125,30 @@ for k, v in col_map.items():
     st.sidebar.write(f"- {k}  →  {v}")
 
 
-if col_map["Delivery_Time"] is None:
+if work is None:
     st.error("Could not find a column that contains delivery time. Check your CSV header names. Possible names: 'Delivery_Time' or 'Delivery Time'.")
     st.stop()
 
 
-work = pd.DataFrame()
-for target in variants.keys():
-    src = col_map.get(target)
-    if src:
-        work[target] = df[src]
-    else:
-        work[target] = np.nan
-
-
-for col in ["Delivery_Time", "Agent_Rating", "Agent_Age"]:
-    if col in work.columns:
-        work[col] = pd.to_numeric(work[col], errors="coerce")
-
-
-before_rows = len(work)
-work = work.dropna(subset=["Delivery_Time"])
-after_rows = len(work)
-
-st.sidebar.write(f"Rows before dropping missing Delivery_Time: {before_rows}")
-st.sidebar.write(f"Rows after dropping missing Delivery_Time: {after_rows}")
+st.sidebar.write(f"Rows before dropping missing Delivery_Time: {diag['before_rows']}")
+st.sidebar.write(f"Rows after dropping missing Delivery_Time: {diag['after_rows']}")
 
 
 st.sidebar.markdown("### Data preview (first 5 rows)")
-st.sidebar.dataframe(work.head())
+st.sidebar.dataframe(work.drop(columns=["Age_Group", "Late"]).head())
 
 st.markdown("### Quick diagnostics")
-st.write("*Columns detected in file:*", list(df.columns))
-st.write("*Standardized columns used in analysis:*", list(work.columns))
+st.write("*Columns detected in file:*", diag["columns"])
+st.write("*Standardized columns used in analysis:*", [c for c in work.columns if c not in ("Age_Group", "Late")])
 st.write(f"Rows available for analysis: {len(work)}")
 
-with st.expander("Value counts (quick)"):
-    for cat in ["Weather", "Traffic", "Vehicle", "Area", "Category"]:
-        if cat in work.columns:
-            st.write(f"{cat}")
-            st.write(work[cat].value_counts(dropna=False).head(20))
+# st.expander renders its body on every rerun, so only count when asked.
+if st.sidebar.checkbox("Show value counts", value=False):
+    with st.expander("Value counts (quick)", expanded=True):
+        for cat in FILTER_COLS:
+            if cat in work.columns:
+                st.write(f"{cat}")
+                st.write(work[cat].value_counts(dropna=False).head(20))
 
 
 if work.empty:
@@ -115,106 +158,200 @@ if work.empty:
     st.stop()
 
 
-work["Age_Group"] = pd.cut(work["Agent_Age"].fillna(-1), bins=[-1,24,40,200], labels=["<25","25-40","40+"], include_lowest=True).astype(str).replace("nan","Unknown")
-mean_dt = work["Delivery_Time"].mean()
-std_dt = work["Delivery_Time"].std()
 threshold = mean_dt + std_dt
-work["Late"] = (work["Delivery_Time"] > threshold).astype(int)
-
 
-st.sidebar.markdown("---")
-st.sidebar.header("Filters (if graphs blank, check these)")
 
 def safe_multiselect(label, col):
-    vals = sorted(work[col].dropna().unique().tolist())
+    vals = UNIQUES[col]
     if not vals:
         return []
-    return st.sidebar.multiselect(label, vals, default=vals)
-
-weather_sel = safe_multiselect("Weather", "Weather")
-traffic_sel = safe_multiselect("Traffic", "Traffic")
-vehicle_sel = safe_multiselect("Vehicle", "Vehicle")
-area_sel = safe_multiselect("Area", "Area")
-category_sel = safe_multiselect("Category", "Category")
-
-filtered = work.copy()
-if weather_sel:
-    filtered = filtered[filtered["Weather"].isin(weather_sel)]
-if traffic_sel:
-    filtered = filtered[filtered["Traffic"].isin(traffic_sel)]
-if vehicle_sel:
-    filtered = filtered[filtered["Vehicle"].isin(vehicle_sel)]
-if area_sel:
-    filtered = filtered[filtered["Area"].isin(area_sel)]
-if category_sel:
-    filtered = filtered[filtered["Category"].isin(category_sel)]
-
-st.write(f"Rows after applying filters: {len(filtered)}")
-
-if filtered.empty:
-    st.warning("No rows match selected filters. Possible actions:\n"
-               "• Clear some filters in the sidebar (click to unselect),\n"
-               "• Check value counts in the diagnostics (sidebar) to choose valid options,\n"
-               "• Or click the button below to reset filters.")
-    if st.button("Reset filters"):
-        
-        st.experimental_rerun()
-
-
-st.subheader("Key metrics")
-col1, col2, col3 = st.columns(3)
-col1.metric("Avg Delivery Time (mins)", round(filtered["Delivery_Time"].mean(),2) if not filtered.empty else "—")
-col2.metric("Total Deliveries", len(filtered))
-col3.metric("Late Deliveries (%)", f"{round(filtered['Late'].mean()*100,2) if len(filtered)>0 else 0}%")
-
-st.markdown("---")
-
+    return st.sidebar.multiselect(label, vals, default=vals, key=f"filter_{col}")
+
+def filter_mask(frame, selections):
+    # One bool lookup per category (plus a trailing slot for NaN, code -1),
+    # gathered by the column's codes and AND-ed in a single reduce.
+    masks = []
+    for col, sel in selections.items():
+        if not sel:
+            continue
+        cats = frame[col].cat.categories
+        lut = np.zeros(len(cats) + 1, dtype=bool)
+        idx = cats.get_indexer(sel)
+        lut[idx[idx >= 0]] = True
+        masks.append(lut[frame[col].cat.codes.to_numpy()])
+    if not masks:
+        return np.ones(len(frame), dtype=bool)
+    return np.logical_and.reduce(masks)
+
+@njit(cache=True)
+def group_means(codes, values, n_groups):
+    # codes is (columns, rows) of category codes; one sweep over values
+    # fills the per-column sum/count accumulators. Code -1 (NaN) is skipped.
+    k, n = codes.shape
+    width = n_groups.max() if k else 0
+    sums = np.zeros((k, width))
+    counts = np.zeros((k, width))
+    for i in range(n):
+        v = values[i]
+        for j in range(k):
+            g = codes[j, i]
+            if g >= 0:
+                sums[j, g] += v
+                counts[j, g] += 1
+    return sums, counts
+
+@njit(cache=True)
+def kpi(dt, thr):
+    # Count, mean and late share in a single read of Delivery_Time.
+    n = len(dt)
+    if n == 0:
+        return 0, np.nan, 0.0
+    s = 0.0
+    late = 0
+    for i in range(n):
+        v = dt[i]
+        s += v
+        if v > thr:
+            late += 1
+    return n, s / n, late / n
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def chart_frames(_df, data_version, weather_t, traffic_t, vehicle_t, area_t, category_t):
+    # _df is skipped by the hasher; data_version (the CSV mtime) stands in for it.
+    mask = filter_mask(_df, {
+        "Weather": weather_t,
+        "Traffic": traffic_t,
+        "Vehicle": vehicle_t,
+        "Area": area_t,
+        "Category": category_t,
+    })
+    sub = _df.iloc[np.flatnonzero(mask)]
+    grp_sums, grp_counts = group_means(
+        # Native codes (int8 here); np.stack only widens if a column needs more levels.
+        np.stack([sub[c].cat.codes.to_numpy() for c in GROUP_COLS]),
+        sub["Delivery_Time"].to_numpy(),
+        np.array([len(_df[c].cat.categories) for c in GROUP_COLS], dtype=np.int64),
+    )
+    group_avg = {}
+    for j, c in enumerate(GROUP_COLS):
+        cats = _df[c].cat.categories
+        cnt = grp_counts[j, :len(cats)]
+        seen = cnt > 0
+        group_avg[c] = pd.DataFrame({c: cats[seen], "Delivery_Time": grp_sums[j, :len(cats)][seen] / cnt[seen]})
+    return mask, group_avg
 
 def safe_bar(df_plot, x, y, title):
     if df_plot.empty:
         st.info(f"No data to plot for {title}.")
         return
-    fig = px.bar(df_plot, x=x, y=y, title=title)
-    st.plotly_chart(fig, use_container_width=True)
+    # sort=None keeps the row order the caller sorted by Delivery_Time.
+    chart = alt.Chart(df_plot, title=title).mark_bar().encode(x=alt.X(x, sort=None), y=y)
+    st.altair_chart(chart, width="stretch")
 
-def safe_scatter(df_plot, x, y, color, title):
-    if df_plot.empty:
+def safe_scatter(x, y, color, labels, title):
+    if len(x) == 0:
         st.info(f"No data to plot for {title}.")
         return
-    fig = px.scatter(df_plot, x=x, y=y, color=color, title=title)
-    st.plotly_chart(fig, use_container_width=True)
-
-# Visual 1: Weather
-st.subheader("Delay Analyzer — Weather")
-weather_grp = filtered.groupby("Weather", as_index=False)["Delivery_Time"].mean().sort_values("Delivery_Time", ascending=False)
-safe_bar(weather_grp, "Weather", "Delivery_Time", "Avg Delivery Time by Weather")
-
-# Visual 1b: Traffic
-st.subheader("Delay Analyzer — Traffic")
-traffic_grp = filtered.groupby("Traffic", as_index=False)["Delivery_Time"].mean().sort_values("Delivery_Time", ascending=False)
-safe_bar(traffic_grp, "Traffic", "Delivery_Time", "Avg Delivery Time by Traffic")
-
-# Visual 2: Vehicle
-st.subheader("Vehicle Performance")
-vehicle_grp = filtered.groupby("Vehicle", as_index=False)["Delivery_Time"].mean().sort_values("Delivery_Time")
-safe_bar(vehicle_grp, "Vehicle", "Delivery_Time", "Avg Delivery Time by Vehicle")
-
-# Visual 3: Agent Performance
-st.subheader("Agent Rating vs Delivery Time")
-safe_scatter(filtered, "Agent_Rating", "Delivery_Time", "Age_Group", "Agent Rating vs Delivery Time")
-
-# Visual 4: Area
-st.subheader("Area — Avg Delivery Time")
-area_grp = filtered.groupby("Area", as_index=False)["Delivery_Time"].mean().sort_values("Delivery_Time", ascending=False)
-safe_bar(area_grp, "Area", "Delivery_Time", "Avg Delivery Time by Area")
-
-# Visual 5: Category
-st.subheader("Category Distribution")
-if filtered.empty:
-    st.info("No category data to show.")
-else:
-    fig_cat = px.box(filtered, x="Category", y="Delivery_Time", title="Delivery Time by Category")
-    st.plotly_chart(fig_cat, use_container_width=True)
-
-st.markdown("---")
-st.caption("If charts are blank: check the diagnostics on the left (column mapping, sample rows, value counts).")
+    n = len(x)
+    if n > SCATTER_MAX_POINTS:
+        # Every point is serialized to the browser; a fixed-seed sample keeps the shape.
+        keep = np.sort(np.random.default_rng(0).choice(n, SCATTER_MAX_POINTS, replace=False))
+        x, y, color = x[keep], y[keep], color[keep]
+    points = pd.DataFrame({labels["x"]: x, labels["y"]: y, labels["color"]: color})
+    chart = alt.Chart(points, title=title).mark_circle().encode(
+        x=labels["x"], y=labels["y"], color=labels["color"], tooltip=list(points.columns))
+    st.altair_chart(chart, width="stretch")
+    if n > SCATTER_MAX_POINTS:
+        st.caption(f"Showing a random sample of {SCATTER_MAX_POINTS} of {n} deliveries.")
+
+@st.fragment
+def dashboard():
+    # Filters, KPIs and charts rerun together as one fragment: a filter change
+    # skips the load and diagnostics above instead of rerunning the whole script.
+    st.sidebar.markdown("---")
+    st.sidebar.header("Filters (if graphs blank, check these)")
+
+    weather_sel = safe_multiselect("Weather", "Weather")
+    traffic_sel = safe_multiselect("Traffic", "Traffic")
+    vehicle_sel = safe_multiselect("Vehicle", "Vehicle")
+    area_sel = safe_multiselect("Area", "Area")
+    category_sel = safe_multiselect("Category", "Category")
+
+    mask, group_avg = chart_frames(
+        work, data_version,
+        tuple(sorted(weather_sel)),
+        tuple(sorted(traffic_sel)),
+        tuple(sorted(vehicle_sel)),
+        tuple(sorted(area_sel)),
+        tuple(sorted(category_sel)),
+    )
+    # Only the columns a visual needs are sliced out by the mask; no filtered frame is built.
+    n_rows = int(mask.sum())
+    delivery = work["Delivery_Time"].to_numpy()[mask]
+
+    st.write(f"Rows after applying filters: {n_rows}")
+
+    if n_rows == 0:
+        st.warning("No rows match selected filters. Possible actions:\n"
+                   "• Clear some filters in the sidebar (click to unselect),\n"
+                   "• Check value counts in the diagnostics (sidebar) to choose valid options,\n"
+                   "• Or click the button below to reset filters.")
+        if st.button("Reset filters"):
+            # Dropping the widget state makes the multiselects fall back to their defaults.
+            for c in FILTER_COLS:
+                st.session_state.pop(f"filter_{c}", None)
+            st.rerun(scope="app")
+
+
+    st.subheader("Key metrics")
+    col1, col2, col3 = st.columns(3)
+    n_kpi, avg_dt, late_share = kpi(delivery, threshold)
+    col1.metric("Avg Delivery Time (mins)", round(avg_dt,2) if n_kpi else "—")
+    col2.metric("Total Deliveries", n_kpi)
+    col3.metric("Late Deliveries (%)", f"{round(late_share*100,2) if n_kpi else 0}%")
+
+    st.markdown("---")
+
+    # Visual 1: Weather
+    st.subheader("Delay Analyzer — Weather")
+    weather_grp = group_avg["Weather"].sort_values("Delivery_Time", ascending=False)
+    safe_bar(weather_grp, "Weather", "Delivery_Time", "Avg Delivery Time by Weather")
+
+    # Visual 1b: Traffic
+    st.subheader("Delay Analyzer — Traffic")
+    traffic_grp = group_avg["Traffic"].sort_values("Delivery_Time", ascending=False)
+    safe_bar(traffic_grp, "Traffic", "Delivery_Time", "Avg Delivery Time by Traffic")
+
+    # Visual 2: Vehicle
+    st.subheader("Vehicle Performance")
+    vehicle_grp = group_avg["Vehicle"].sort_values("Delivery_Time")
+    safe_bar(vehicle_grp, "Vehicle", "Delivery_Time", "Avg Delivery Time by Vehicle")
+
+    # Visual 3: Agent Performance
+    st.subheader("Agent Rating vs Delivery Time")
+    safe_scatter(
+        work["Agent_Rating"].to_numpy()[mask],
+        delivery,
+        work["Age_Group"].to_numpy()[mask],
+        {"x": "Agent_Rating", "y": "Delivery_Time", "color": "Age_Group"},
+        "Agent Rating vs Delivery Time",
+    )
+
+    # Visual 4: Area
+    st.subheader("Area — Avg Delivery Time")
+    area_grp = group_avg["Area"].sort_values("Delivery_Time", ascending=False)
+    safe_bar(area_grp, "Area", "Delivery_Time", "Avg Delivery Time by Area")
+
+    # Visual 5: Category
+    st.subheader("Category Distribution")
+    if n_rows == 0:
+        st.info("No category data to show.")
+    else:
+        fig_cat = px.box(x=work["Category"].to_numpy()[mask], y=delivery,
+                         labels={"x": "Category", "y": "Delivery_Time"}, title="Delivery Time by Category")
+        st.plotly_chart(fig_cat, width="stretch")
+
+    st.markdown("---")
+    st.caption("If charts are blank: check the diagnostics on the left (column mapping, sample rows, value counts).")
+
+dashboard()